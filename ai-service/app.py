@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import spacy
 import re
@@ -12,7 +12,23 @@ import docx
 from io import BytesIO
 import requests
 import os
+import hmac
+import math
+import tempfile
+import threading
+import time
+from functools import wraps
 from dotenv import load_dotenv
+from profiling import (
+    SamplingProfiler, SharedProfilerState, SlowRequestLog,
+    format_collapsed, record_input_size, timed_stage
+)
+from serialization import MSGPACK_MIMETYPES, OrjsonProvider, encode_skill_ids, orjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Load environment variables
 load_dotenv()
@@ -20,6 +36,81 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Use orjson for jsonify() when it is installed
+if orjson:
+    app.json = OrjsonProvider(app)
+
+# Runtime profiling, shared between worker processes through PROFILER_STATE_DIR
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+MAX_PROFILE_SECONDS = 300
+MAX_PROFILE_REQUESTS = 100000
+SLOW_REQUEST_RETENTION = float(os.environ.get('SLOW_REQUEST_RETENTION_HOURS', 24)) * 3600
+
+def default_profiler_state_dir():
+    """Per-user directory under the system temp dir (checked for ownership on use)"""
+    name = f'ai-service-profiler-{os.getuid()}' if hasattr(os, 'getuid') else 'ai-service-profiler'
+    return os.path.join(tempfile.gettempdir(), name)
+
+shared_profiler_state = SharedProfilerState(
+    os.environ.get('PROFILER_STATE_DIR') or default_profiler_state_dir()
+)
+
+def flush_profiler(profiler):
+    """Publish samples and pick up stop commands from the sampling thread"""
+    shared_profiler_state.publish_profile(profiler)
+    shared_profiler_state.sync(profiler, can_start=False)
+
+profiler = SamplingProfiler(
+    interval=float(os.environ.get('PROFILER_INTERVAL_MS', 5)) / 1000,
+    on_flush=flush_profiler
+)
+slow_requests = SlowRequestLog(
+    threshold_ms=float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000)),
+    size=int(os.environ.get('SLOW_REQUEST_BUFFER_SIZE', 100))
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    shared_profiler_state.sync(profiler)
+    if not request.path.startswith('/admin/'):
+        profiler.track(threading.get_ident())
+
+@app.after_request
+def capture_slow_request(response):
+    if 'request_start' in g and not request.path.startswith('/admin/'):
+        recorded = slow_requests.record({
+            'pid': os.getpid(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.request_start) * 1000, 2),
+            'request_size': request.content_length,
+            'response_size': response.calculate_content_length(),
+            'stages': g.get('stage_timings', []),
+            'timestamp': time.time()
+        })
+        if recorded:
+            shared_profiler_state.publish_slow_requests(slow_requests)
+    return response
+
+@app.teardown_request
+def stop_request_tracking(exc):
+    if not request.path.startswith('/admin/'):
+        profiler.untrack(threading.get_ident())
+
+def require_admin(func):
+    """Restrict an endpoint to callers presenting the admin token"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 403
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Invalid admin token'}), 401
+        return func(*args, **kwargs)
+    return wrapper
+
 # Download required NLTK data
 try:
     nltk.data.find('tokenizers/punkt')
@@ -72,6 +163,7 @@ SOFT_SKILLS = [
     'public speaking', 'negotiation', 'collaboration', 'adaptability', 'creativity'
 ]
 
+@timed_stage
 def extract_text_from_pdf(file_content):
     """Extract text from PDF file"""
     try:
@@ -85,6 +177,7 @@ def extract_text_from_pdf(file_content):
         print(f"Error extracting PDF: {e}")
         return ""
 
+@timed_stage
 def extract_text_from_docx(file_content):
     """Extract text from DOCX file"""
     try:
@@ -98,6 +191,7 @@ def extract_text_from_docx(file_content):
         print(f"Error extracting DOCX: {e}")
         return ""
 
+@timed_stage
 def extract_text_from_url(url):
     """Extract text from URL (for Cloudinary links)"""
     try:
@@ -106,6 +200,8 @@ def extract_text_from_url(url):
         print(f"📊 Response status: {response.status_code}")
         
         if response.status_code == 200:
+            record_input_size(len(response.content))
+            
             # Check content type from headers
             content_type = response.headers.get('content-type', '').lower()
             print(f"📄 Content-Type: {content_type}")
@@ -141,6 +237,7 @@ def extract_text_from_url(url):
         print(f"❌ Error extracting from URL: {e}")
     return ""
 
+@timed_stage
 def clean_text(text):
     """Clean and normalize text"""
     if not text:
@@ -157,6 +254,7 @@ def clean_text(text):
     
     return text
 
+@timed_stage
 def extract_skills_with_spacy(text):
     """Extract skills using spaCy NER and pattern matching"""
     if not nlp or not text:
@@ -184,6 +282,7 @@ def extract_skills_with_spacy(text):
     
     return list(skills)
 
+@timed_stage
 def extract_skills_with_regex(text):
     """Fallback skill extraction using regex patterns"""
     if not text:
@@ -237,10 +336,38 @@ def calculate_skill_similarity(user_skills, job_requirements):
     match_score = len(common_skills) / len(job_requirements_lower) * 100
     return round(match_score, 2)
 
+def wants_skill_ids():
+    """Check whether the client asked for dictionary-encoded skills"""
+    encoding = request.headers.get('X-Skill-Encoding') or request.args.get('skill_encoding', '')
+    return encoding.lower() == 'dictionary'
+
+def api_response(payload, status=200):
+    """Serialize a successful response using the encoding the client negotiated
+
+    Clients may send `Accept: application/msgpack` for a MessagePack body and
+    `X-Skill-Encoding: dictionary` (or `?skill_encoding=dictionary`) to receive
+    skills as integer IDs into a `skill_vocabulary` table. JSON is the default.
+    """
+    if wants_skill_ids():
+        payload = encode_skill_ids(payload)
+
+    mimetype = request.accept_mimetypes.best_match(
+        ['application/json'] + MSGPACK_MIMETYPES, default='application/json'
+    )
+
+    if mimetype in MSGPACK_MIMETYPES and msgpack:
+        response = Response(msgpack.packb(payload, use_bin_type=True), status=status, mimetype=mimetype)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+
+    response.vary.update(['Accept', 'X-Skill-Encoding'])
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return api_response({
         'status': 'healthy',
         'service': 'NLP Skill Extraction',
         'spacy_loaded': nlp is not None
@@ -285,7 +412,7 @@ def extract_skills():
         # Remove duplicates and sort
         skills = sorted(list(set(skills)))
         
-        return jsonify({
+        return api_response({
             'success': True,
             'skills': skills,
             'skill_count': len(skills),
@@ -323,7 +450,7 @@ def match_skills():
         missing_skills = [req for req in job_requirements_lower if req not in user_skills_lower]
         matching_skills = [req for req in job_requirements_lower if req in user_skills_lower]
         
-        return jsonify({
+        return api_response({
             'success': True,
             'match_score': match_score,
             'matching_skills': matching_skills,
@@ -373,7 +500,7 @@ def analyze_resume():
         word_count = len(cleaned_text.split())
         char_count = len(cleaned_text)
         
-        return jsonify({
+        return api_response({
             'success': True,
             'skills': {
                 'all': skills,
@@ -396,6 +523,146 @@ def analyze_resume():
             'error': f'Error analyzing resume: {str(e)}'
         }), 500
 
+def parse_positive_number(value, name, integer=False):
+    """Validate a profiler option; bools, NaN and infinity are rejected"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'{name} must be a number')
+    number = float(value)
+    if not math.isfinite(number) or number <= 0:
+        raise ValueError(f'{name} must be a positive finite number')
+    if integer:
+        if not number.is_integer():
+            raise ValueError(f'{name} must be a whole number')
+        return int(number)
+    return number
+
+def profiler_summary():
+    """Merge the published profiles of the current run across workers"""
+    shared_profiler_state.publish_profile(profiler)
+    control = shared_profiler_state.control() or {}
+    profiles = shared_profiler_state.collect_profiles(control['run']) if control.get('run') else []
+    
+    stacks = {}
+    for profile in profiles:
+        for stack, count in profile['stacks'].items():
+            stacks[stack] = stacks.get(stack, 0) + count
+    
+    workers = [profile['status'] for profile in profiles]
+    return {
+        'pid': os.getpid(),
+        'run': control.get('run'),
+        'running': any(worker['running'] for worker in workers),
+        'samples': sum(worker['samples'] for worker in workers),
+        'workers': workers
+    }, stacks
+
+@app.route('/admin/profiler/start', methods=['POST'])
+@require_admin
+def start_profiler():
+    """Start the sampling profiler on every worker for N seconds and/or N requests per worker
+
+    Runs always end after MAX_PROFILE_SECONDS, even when only `requests` is given.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    
+    seconds = data.get('seconds')
+    max_requests = data.get('requests')
+    
+    if seconds is None and max_requests is None:
+        seconds = 30
+    
+    try:
+        if seconds is not None:
+            seconds = parse_positive_number(seconds, 'seconds')
+            if seconds > MAX_PROFILE_SECONDS:
+                raise ValueError(f'seconds must be at most {MAX_PROFILE_SECONDS}')
+        
+        else:
+            seconds = MAX_PROFILE_SECONDS
+        
+        if max_requests is not None:
+            max_requests = parse_positive_number(max_requests, 'requests', integer=True)
+            if max_requests > MAX_PROFILE_REQUESTS:
+                raise ValueError(f'requests must be at most {MAX_PROFILE_REQUESTS}')
+    except (ValueError, OverflowError) as e:
+        return jsonify({'error': f'Invalid profiler options: {str(e)}'}), 400
+    
+    summary, _ = profiler_summary()
+    if summary['running']:
+        return jsonify({'error': 'Profiler is already running', 'profiler': summary}), 409
+    
+    shared_profiler_state.broadcast(
+        'start',
+        deadline=time.time() + seconds,
+        max_requests=max_requests
+    )
+    shared_profiler_state.sync(profiler)
+    
+    return jsonify({
+        'success': True,
+        'profiler': profiler_summary()[0]
+    })
+
+@app.route('/admin/profiler/stop', methods=['POST'])
+@require_admin
+def stop_profiler():
+    """Stop the sampling profiler on every worker"""
+    shared_profiler_state.broadcast('stop')
+    shared_profiler_state.sync(profiler)
+    profiler.join(timeout=1)
+    
+    return jsonify({
+        'success': True,
+        'profiler': profiler_summary()[0]
+    })
+
+@app.route('/admin/profiler', methods=['GET'])
+@require_admin
+def profiler_dump():
+    """Return samples from all workers as collapsed stacks (flamegraph.pl / speedscope input)"""
+    summary, stacks = profiler_summary()
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'success': True,
+            'profiler': summary,
+            'collapsed': format_collapsed(stacks)
+        })
+    
+    response = Response(format_collapsed(stacks), mimetype='text/plain')
+    response.headers['X-Profiler-Pid'] = str(summary['pid'])
+    response.headers['X-Profiler-Running'] = str(summary['running']).lower()
+    response.headers['X-Profiler-Samples'] = str(summary['samples'])
+    response.headers['X-Profiler-Workers'] = str(len(summary['workers']))
+    return response
+
+@app.route('/admin/slow-requests', methods=['GET'])
+@require_admin
+def slow_request_log():
+    """Return slow requests captured by all workers with stage timings, most recent first"""
+    limit = request.args.get('limit', type=int)
+    if 'limit' in request.args and (limit is None or limit < 1):
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    
+    entries = shared_profiler_state.collect_slow_requests(max_age=SLOW_REQUEST_RETENTION)
+    workers = len({entry.get('pid') for entry in entries})
+    entries = entries[:limit] if limit is not None else entries
+    
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'threshold_ms': slow_requests.threshold_ms,
+        # Per worker; the merged log holds up to buffer_size * workers entries
+        'buffer_size': slow_requests.size,
+        'workers': workers,
+        'count': len(entries),
+        'requests': entries
+    })
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('FLASK_ENV') == 'development'
@@ -407,5 +674,7 @@ if __name__ == '__main__':
     print(f"   - POST /extract-skills")
     print(f"   - POST /match-skills")
     print(f"   - POST /analyze-resume")
+    print(f"   - POST /admin/profiler/start, /admin/profiler/stop")
+    print(f"   - GET  /admin/profiler, /admin/slow-requests")
     
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,447 @@
+"""
+Runtime profiling helpers for the AI service
+Sampling profiler with collapsed-stack output, a slow-request ring buffer,
+and file-based state shared between worker processes
+"""
+
+import glob
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from functools import wraps
+
+from flask import g, has_request_context
+
+
+class SamplingProfiler:
+    """Low-overhead sampling profiler for threads that are serving requests"""
+
+    def __init__(self, interval=0.005, flush_interval=1.0, on_flush=None):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self._lock = threading.Lock()
+        self._stacks = Counter()
+        self._threads = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.run = None
+        self.deadline = None
+        self.max_requests = None
+        self.requests_seen = 0
+        self.samples = 0
+
+    @property
+    def running(self):
+        return (self._thread is not None and self._thread.is_alive()
+                and not self._stop_event.is_set())
+
+    def start(self, seconds=None, max_requests=None, run=None):
+        """Start sampling for a number of seconds and/or requests"""
+        if self.running:
+            return False
+        # A stopped thread may still be publishing its final flush
+        self.join()
+
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+            self.requests_seen = 0
+            self.run = run
+            self.max_requests = max_requests
+            self.deadline = time.monotonic() + seconds if seconds is not None else None
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop sampling; collected stacks are kept until the next start"""
+        self._stop_event.set()
+
+    def join(self, timeout=None):
+        """Wait for the sampling thread to exit"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def track(self, thread_id):
+        """Mark a thread as serving a request"""
+        with self._lock:
+            self._threads.add(thread_id)
+
+    def untrack(self, thread_id):
+        """Unmark a thread once its request is finished"""
+        with self._lock:
+            self._threads.discard(thread_id)
+            if not self.running:
+                return
+            self.requests_seen += 1
+            if self.max_requests and self.requests_seen >= self.max_requests:
+                self._stop_event.set()
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'run': self.run,
+            'running': self.running,
+            'samples': self.samples,
+            'requests_seen': self.requests_seen,
+            'max_requests': self.max_requests,
+            'seconds_remaining': (
+                round(max(self.deadline - time.monotonic(), 0), 2)
+                if self.deadline is not None and self.running else None
+            ),
+            'interval_ms': self.interval * 1000
+        }
+
+    def stacks(self):
+        """Return a copy of the sampled stack counts"""
+        with self._lock:
+            return dict(self._stacks)
+
+    def collapsed(self):
+        """Return samples in collapsed-stack format (one `frame;frame count` per line)"""
+        return format_collapsed(self.stacks())
+
+    def _run(self):
+        last_flush = time.monotonic()
+        try:
+            while not self._stop_event.wait(self.interval):
+                now = time.monotonic()
+                if self.deadline is not None and now >= self.deadline:
+                    break
+
+                if self.on_flush and now - last_flush >= self.flush_interval:
+                    last_flush = now
+                    self.on_flush(self)
+
+                with self._lock:
+                    threads = set(self._threads)
+                if not threads:
+                    continue
+
+                frames = sys._current_frames()
+                stacks = [
+                    self._format_stack(frames[thread_id])
+                    for thread_id in threads if thread_id in frames
+                ]
+
+                with self._lock:
+                    self._stacks.update(stacks)
+                    self.samples += 1
+        finally:
+            self._stop_event.set()
+            if self.on_flush:
+                self.on_flush(self)
+
+    @staticmethod
+    def _format_stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+
+class SlowRequestLog:
+    """Bounded ring buffer of requests slower than a latency threshold"""
+
+    def __init__(self, threshold_ms=1000, size=100):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._entries.maxlen
+
+    def record(self, entry):
+        """Keep the entry if it is over the threshold"""
+        if entry['duration_ms'] < self.threshold_ms:
+            return False
+        with self._lock:
+            self._entries.append(entry)
+        return True
+
+    def entries(self, limit=None):
+        """Return captured entries, most recent first"""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit is not None else entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedProfilerState:
+    """Profiler control and results shared between worker processes through a directory
+
+    An admin request only reaches one worker, so start/stop commands are written
+    to a control file that every worker applies on its next request (or within
+    one flush interval while sampling). Each worker publishes its stacks and slow
+    requests to per-pid files, which the admin endpoints merge; files left by
+    workers that have exited are deleted when they are collected.
+
+    The directory must be private to the service user, since anyone who can
+    write to it can start profiling or inject slow-request entries. An unsafe
+    directory is replaced by a private temporary one, which is not shared.
+    """
+
+    def __init__(self, directory, pid=None):
+        if not private_directory(directory):
+            fallback = tempfile.mkdtemp(prefix='ai-service-profiler-')
+            print(f"⚠️  Profiler state directory {directory} is not private to this user, "
+                  f"using {fallback} (not shared between workers)")
+            directory = fallback
+
+        self.directory = directory
+        self.control_path = os.path.join(directory, 'control.json')
+        self._pid = pid
+        self._lock = threading.Lock()
+        self._control_key = None
+        self._applied = None
+        self._claimed_pid = None
+        self.claim()
+
+    @property
+    def pid(self):
+        return self._pid or os.getpid()
+
+    def claim(self):
+        """Delete files left by an exited worker that had this worker's pid"""
+        if self._claimed_pid == self.pid:
+            return
+        self._claimed_pid = self.pid
+        for prefix in ('profile', 'slow'):
+            self._remove(self._worker_path(prefix, self.pid))
+
+    def _worker_path(self, prefix, pid):
+        return os.path.join(self.directory, f'{prefix}-{pid}.json')
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _collect(self, prefix, max_age=None):
+        """Return (path, data) for every live worker's file with this prefix
+
+        Files whose pid has exited, or that are older than `max_age` seconds,
+        are deleted instead.
+        """
+        collected = []
+        for path in sorted(glob.glob(os.path.join(self.directory, f'{prefix}-*.json'))):
+            pid = os.path.basename(path)[len(prefix) + 1:-len('.json')]
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue
+            if not pid.isdigit() or not pid_alive(int(pid)) or (max_age is not None and age > max_age):
+                self._remove(path)
+                continue
+            data = self._read(path)
+            if data:
+                collected.append((path, data))
+        return collected
+
+    def control(self):
+        """Return the last broadcast command"""
+        return self._read(self.control_path)
+
+    def broadcast(self, action, deadline=None, max_requests=None):
+        """Write a start/stop command for every worker; returns the command"""
+        previous = self.control() or {}
+        generation = time.time_ns()
+        command = {
+            'action': action,
+            'generation': generation,
+            # Run whose results the dump endpoint should merge
+            'run': generation if action == 'start' else previous.get('run'),
+            'deadline': deadline,
+            'max_requests': max_requests,
+            'pid': self.pid
+        }
+        self._write(self.control_path, command)
+        return command
+
+    def sync(self, profiler, can_start=True):
+        """Apply a command broadcast by any worker, if there is a new one
+
+        The sampling thread passes `can_start=False`: it can only stop itself,
+        leaving restarts to the next request.
+        """
+        self.claim()
+        try:
+            info = os.stat(self.control_path)
+        except OSError:
+            return
+        key = (info.st_ino, info.st_mtime_ns, info.st_size)
+        if key == self._control_key:
+            return
+
+        if not self._lock.acquire(blocking=can_start):
+            return
+        try:
+            command = self.control()
+            if not command or command['generation'] == self._applied:
+                self._control_key = key
+                return
+
+            if command['action'] == 'stop':
+                profiler.stop()
+            elif not can_start:
+                profiler.stop()
+                return
+            else:
+                if profiler.running:
+                    profiler.stop()
+                    profiler.join()
+                deadline = command.get('deadline')
+                seconds = deadline - time.time() if deadline is not None else None
+                if seconds is None or seconds > 0:
+                    profiler.start(seconds, command.get('max_requests'), command['run'])
+
+            self._applied = command['generation']
+            self._control_key = key
+        finally:
+            self._lock.release()
+
+    def publish_profile(self, profiler):
+        """Write this worker's profiler status and stacks"""
+        self._write(self._worker_path('profile', self.pid), {
+            'status': profiler.status(),
+            'stacks': profiler.stacks()
+        })
+
+    def collect_profiles(self, run, stale_after=5.0):
+        """Return published profiles belonging to a run, one per worker
+
+        A running worker republishes every flush interval, so a profile that
+        still says `running` but has not been updated for `stale_after`
+        seconds belongs to a worker that has exited and is reported as stopped.
+        """
+        profiles = []
+        for path, data in self._collect('profile'):
+            if data['status'].get('run') != run:
+                continue
+            try:
+                stale = time.time() - os.path.getmtime(path) > stale_after
+            except OSError:
+                continue
+            if stale:
+                data['status']['running'] = False
+            profiles.append(data)
+        return profiles
+
+    def publish_slow_requests(self, slow_requests):
+        """Write this worker's slow-request buffer"""
+        self._write(self._worker_path('slow', self.pid), slow_requests.entries())
+
+    def collect_slow_requests(self, limit=None, max_age=None):
+        """Return slow requests from every live worker, most recent first"""
+        entries = [entry for _, worker_entries in self._collect('slow', max_age) for entry in worker_entries]
+        entries.sort(key=lambda entry: entry['timestamp'], reverse=True)
+        return entries[:limit] if limit is not None else entries
+
+
+def private_directory(directory):
+    """Create `directory` (mode 0700) if needed; True if only the current user can use it"""
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.lstat(directory)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode):
+        return False
+    if not hasattr(os, 'getuid'):
+        # No POSIX ownership to check (Windows); rely on the user profile's temp dir
+        return True
+    return info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+
+def pid_alive(pid):
+    """Check whether a process with this pid exists"""
+    if os.name == 'nt':
+        # os.kill() terminates processes on Windows; rely on max_age there
+        return True
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, OverflowError):
+        return False
+    except PermissionError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+def format_collapsed(stacks):
+    """Format {stack: count} as collapsed-stack lines, most sampled first"""
+    lines = [f"{stack} {count}" for stack, count in Counter(stacks).most_common()]
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def payload_size(value):
+    """Size of a stage input or output (characters for text, bytes for file content)"""
+    if isinstance(value, (str, bytes, bytearray, list)):
+        return len(value)
+    return None
+
+
+def record_input_size(size):
+    """Override the input size of the stage currently running (e.g. downloaded bytes)"""
+    if has_request_context() and g.get('stage_stack'):
+        g.stage_stack[-1]['input_size'] = size
+
+
+def timed_stage(func):
+    """Record the duration and input/output sizes of a processing stage for the current request"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not has_request_context():
+            return func(*args, **kwargs)
+
+        stage = {
+            'stage': func.__name__,
+            'input_size': payload_size(args[0]) if args else None
+        }
+        stage_stack = g.setdefault('stage_stack', [])
+        stage_stack.append(stage)
+        start = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            stage_stack.pop()
+            stage['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            stage['output_size'] = payload_size(result)
+            g.setdefault('stage_timings', []).append(stage)
+    return wrapper
@@ -0,0 +1,80 @@
+"""
+Response serialization helpers for the AI service
+orjson-backed JSON provider and dictionary encoding of skill lists
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Response keys whose values are lists of skill names
+SKILL_LIST_KEYS = {
+    'skills', 'all', 'technical', 'soft',
+    'matching_skills', 'matched_skills', 'missing_skills'
+}
+
+MSGPACK_MIMETYPES = ['application/msgpack', 'application/x-msgpack']
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster encoding of large payloads
+
+    Anything orjson refuses (e.g. integers beyond 64 bits) is encoded by the
+    stdlib provider instead, so switching encoders never turns a response into
+    an error.
+    """
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, **kwargs)
+
+
+class SkillVocabulary(dict):
+    """Skill name -> ID table that assigns the next ID on first lookup"""
+
+    def __missing__(self, skill):
+        if type(skill) is not str:
+            raise TypeError(f'skill names must be strings, got {type(skill).__name__}')
+        skill_id = self[skill] = len(self)
+        return skill_id
+
+
+def encode_skill_ids(payload):
+    """Replace skill name lists with integer IDs into a shared vocabulary table
+
+    Only lists under SKILL_LIST_KEYS are interned; other lists are descended
+    into only when they hold dicts (e.g. a list of per-job match results).
+    Skill lists containing anything but strings are left unchanged.
+    """
+    vocabulary = SkillVocabulary()
+    lookup = vocabulary.__getitem__
+
+    def encode(node):
+        encoded = dict(node)
+        for key, value in node.items():
+            value_type = type(value)
+            if value_type is dict:
+                encoded[key] = encode(value)
+            elif value_type is list and value:
+                first = value[0]
+                if key in SKILL_LIST_KEYS and type(first) is str:
+                    try:
+                        encoded[key] = list(map(lookup, value))
+                    except TypeError:
+                        pass
+                elif type(first) is dict:
+                    encoded[key] = [encode(item) if type(item) is dict else item for item in value]
+        return encoded
+
+    encoded = encode(payload)
+    encoded['skill_encoding'] = 'dictionary'
+    encoded['skill_vocabulary'] = list(vocabulary)
+    return encoded
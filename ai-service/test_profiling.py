@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the profiling helpers
+Run with: python -m unittest test_profiling (no running service needed)
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask, g
+
+from profiling import (
+    SamplingProfiler, SharedProfilerState, SlowRequestLog,
+    format_collapsed, pid_alive, private_directory, record_input_size, timed_stage
+)
+
+
+def exited_pid():
+    """Return the pid of a process that has already exited"""
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class SlowRequestLogTest(unittest.TestCase):
+
+    def entry(self, duration_ms, index=0):
+        return {'duration_ms': duration_ms, 'index': index, 'timestamp': index}
+
+    def test_threshold(self):
+        log = SlowRequestLog(threshold_ms=100, size=10)
+        self.assertFalse(log.record(self.entry(99.9)))
+        self.assertTrue(log.record(self.entry(100)))
+        self.assertEqual(len(log.entries()), 1)
+
+    def test_buffer_is_bounded_and_most_recent_first(self):
+        log = SlowRequestLog(threshold_ms=0, size=3)
+        for index in range(5):
+            log.record(self.entry(10, index))
+        self.assertEqual([entry['index'] for entry in log.entries()], [4, 3, 2])
+        self.assertEqual([entry['index'] for entry in log.entries(limit=2)], [4, 3])
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def busy_worker(self, profiler, stop):
+        profiler.track(threading.get_ident())
+        while not stop.is_set():
+            sum(range(1000))
+        profiler.untrack(threading.get_ident())
+
+    def test_request_limit_stops_profiler(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start(max_requests=2)
+        profiler.track(1)
+        profiler.untrack(1)
+        self.assertTrue(profiler.running)
+        profiler.track(1)
+        profiler.untrack(1)
+        self.assertTrue(wait_until(lambda: not profiler.running))
+        self.assertEqual(profiler.requests_seen, 2)
+
+    def test_deadline_stops_profiler(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start(seconds=0.05)
+        self.assertTrue(profiler.running)
+        self.assertTrue(wait_until(lambda: not profiler.running))
+
+    def test_start_while_running_is_rejected(self):
+        profiler = SamplingProfiler(interval=0.001)
+        self.assertTrue(profiler.start(seconds=1))
+        self.assertFalse(profiler.start(seconds=1))
+        profiler.stop()
+        profiler.join()
+        self.assertFalse(profiler.running)
+
+    def test_collapsed_stacks_of_tracked_threads(self):
+        profiler = SamplingProfiler(interval=0.001)
+        stop = threading.Event()
+        worker = threading.Thread(target=self.busy_worker, args=(profiler, stop))
+        profiler.start(seconds=5)
+        worker.start()
+        self.assertTrue(wait_until(lambda: profiler.samples >= 5))
+        stop.set()
+        worker.join()
+        profiler.stop()
+        profiler.join()
+
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r'^\S.*;.* \d+$')
+        self.assertTrue(any(re.search(r'busy_worker \(test_profiling\.py:\d+\)', line) for line in lines))
+        # Only tracked threads are sampled
+        self.assertFalse(any('test_collapsed_stacks_of_tracked_threads' in line for line in lines))
+
+    def test_format_collapsed_orders_by_count(self):
+        self.assertEqual(format_collapsed({'a;b': 1, 'a;c': 3}), "a;c 3\na;b 1\n")
+        self.assertEqual(format_collapsed({}), "")
+
+
+class SharedProfilerStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.workers = []
+        # Two live pids stand in for two workers
+        for pid in (os.getpid(), os.getppid()):
+            state = SharedProfilerState(self.directory, pid=pid)
+            profiler = SamplingProfiler(interval=0.001)
+            self.addCleanup(profiler.stop)
+            self.workers.append((state, profiler))
+
+    def test_start_and_stop_reach_every_worker(self):
+        (state_a, profiler_a), (state_b, profiler_b) = self.workers
+        command = state_a.broadcast('start', deadline=time.time() + 5, max_requests=None)
+        state_a.sync(profiler_a)
+        state_b.sync(profiler_b)
+        self.assertTrue(profiler_a.running and profiler_b.running)
+        self.assertEqual(profiler_b.run, command['run'])
+        self.assertLess(profiler_b.status()['seconds_remaining'], 5.01)
+
+        state_b.broadcast('stop')
+        state_a.sync(profiler_a, can_start=False)
+        profiler_a.join(1)
+        self.assertFalse(profiler_a.running)
+        self.assertEqual(state_b.control()['run'], command['run'])
+
+    def test_expired_start_is_ignored(self):
+        state, profiler = self.workers[0]
+        state.broadcast('start', deadline=time.time() - 1)
+        state.sync(profiler)
+        self.assertFalse(profiler.running)
+
+    def test_sampler_sync_does_not_start(self):
+        state, profiler = self.workers[0]
+        state.broadcast('start', deadline=time.time() + 5)
+        state.sync(profiler, can_start=False)
+        self.assertFalse(profiler.running)
+        state.sync(profiler)
+        self.assertTrue(profiler.running)
+
+    def test_profiles_are_merged_per_run(self):
+        (state_a, profiler_a), (state_b, profiler_b) = self.workers
+        run = state_a.broadcast('start', deadline=time.time() + 5)['run']
+        state_a.sync(profiler_a)
+        state_a.publish_profile(profiler_a)
+        state_b.publish_profile(profiler_b)  # never started: belongs to no run
+        profiles = state_a.collect_profiles(run)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0]['status']['running'])
+
+        stale = time.time() - 60
+        os.utime(os.path.join(self.directory, f'profile-{state_a.pid}.json'), (stale, stale))
+        self.assertFalse(state_a.collect_profiles(run)[0]['status']['running'])
+
+    def test_slow_requests_are_merged_across_workers(self):
+        for index, (state, _) in enumerate(self.workers):
+            log = SlowRequestLog(threshold_ms=0, size=5)
+            log.record({'duration_ms': 1, 'timestamp': index, 'pid': state.pid})
+            log.record({'duration_ms': 1, 'timestamp': index + 10, 'pid': state.pid})
+            state.publish_slow_requests(log)
+        entries = self.workers[0][0].collect_slow_requests()
+        self.assertEqual([entry['timestamp'] for entry in entries], [11, 10, 1, 0])
+        self.assertEqual(len(self.workers[0][0].collect_slow_requests(limit=3)), 3)
+
+    @unittest.skipIf(os.name == 'nt', 'pid liveness is not checked on Windows')
+    def test_files_of_exited_workers_are_deleted(self):
+        pid = exited_pid()
+        self.assertFalse(pid_alive(pid))
+        dead = SharedProfilerState(self.directory, pid=pid)
+        log = SlowRequestLog(threshold_ms=0)
+        log.record({'duration_ms': 1, 'timestamp': 1, 'pid': pid})
+        dead.publish_slow_requests(log)
+        dead.publish_profile(SamplingProfiler())
+
+        state = self.workers[0][0]
+        self.assertEqual(state.collect_slow_requests(), [])
+        state.collect_profiles(None)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_old_files_are_deleted(self):
+        state = self.workers[0][0]
+        log = SlowRequestLog(threshold_ms=0)
+        log.record({'duration_ms': 1, 'timestamp': 1})
+        state.publish_slow_requests(log)
+        self.assertEqual(len(state.collect_slow_requests(max_age=60)), 1)
+
+        old = time.time() - 120
+        os.utime(os.path.join(self.directory, f'slow-{state.pid}.json'), (old, old))
+        self.assertEqual(state.collect_slow_requests(max_age=60), [])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_new_worker_claims_files_of_reused_pid(self):
+        state = self.workers[0][0]
+        log = SlowRequestLog(threshold_ms=0)
+        log.record({'duration_ms': 1, 'timestamp': 1})
+        state.publish_slow_requests(log)
+        SharedProfilerState(self.directory, pid=state.pid)
+        self.assertEqual(state.collect_slow_requests(), [])
+
+    def test_writes_leave_no_temporary_files(self):
+        state, profiler = self.workers[0]
+        state.broadcast('stop')
+        state.publish_profile(profiler)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['control.json', f'profile-{state.pid}.json'])
+
+
+@unittest.skipIf(not hasattr(os, 'getuid'), 'POSIX permissions only')
+class PrivateDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.parent)
+
+    def test_created_private(self):
+        directory = os.path.join(self.parent, 'state')
+        self.assertTrue(private_directory(directory))
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    def test_shared_directory_is_refused(self):
+        directory = os.path.join(self.parent, 'state')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        self.assertFalse(private_directory(directory))
+
+    def test_symlink_is_refused(self):
+        target = os.path.join(self.parent, 'target')
+        os.mkdir(target, 0o700)
+        link = os.path.join(self.parent, 'link')
+        os.symlink(target, link)
+        self.assertFalse(private_directory(link))
+
+    def test_unsafe_directory_falls_back_to_private_one(self):
+        directory = os.path.join(self.parent, 'state')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        state = SharedProfilerState(directory)
+        self.addCleanup(shutil.rmtree, state.directory)
+        self.assertNotEqual(state.directory, directory)
+        self.assertTrue(private_directory(state.directory))
+
+
+class TimedStageTest(unittest.TestCase):
+
+    def test_records_sizes_and_download_override(self):
+        @timed_stage
+        def download(url):
+            record_input_size(2048)
+            return inner("x" * 10)
+
+        @timed_stage
+        def inner(text):
+            return text.upper()
+
+        app = Flask(__name__)
+        with app.test_request_context():
+            self.assertEqual(download("http://example.com/resume.pdf"), "X" * 10)
+            stages = {stage['stage']: stage for stage in g.stage_timings}
+
+        self.assertEqual(stages['download']['input_size'], 2048)
+        self.assertEqual(stages['download']['output_size'], 10)
+        self.assertEqual(stages['inner']['input_size'], 10)
+        self.assertGreaterEqual(stages['inner']['duration_ms'], 0)
+
+    def test_outside_request_context(self):
+        @timed_stage
+        def stage(text):
+            return text
+
+        self.assertEqual(stage("abc"), "abc")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the response serialization helpers
+Run with: python -m unittest test_serialization (no running service needed)
+"""
+
+import json
+import unittest
+
+from flask import Flask
+
+from serialization import SKILL_LIST_KEYS, OrjsonProvider, encode_skill_ids, orjson
+
+
+def decode_skill_ids(node, vocabulary):
+    """Reverse encode_skill_ids the way a client would"""
+    if isinstance(node, dict):
+        return {
+            key: (
+                [vocabulary[item] for item in value]
+                if key in SKILL_LIST_KEYS and isinstance(value, list) and value
+                and all(type(item) is int for item in value)
+                else decode_skill_ids(value, vocabulary)
+            )
+            for key, value in node.items()
+        }
+    if isinstance(node, list):
+        return [decode_skill_ids(item, vocabulary) for item in node]
+    return node
+
+
+class EncodeSkillIdsTest(unittest.TestCase):
+
+    def round_trip(self, payload):
+        encoded = encode_skill_ids(payload)
+        self.assertEqual(encoded.pop('skill_encoding'), 'dictionary')
+        vocabulary = encoded.pop('skill_vocabulary')
+        self.assertEqual(decode_skill_ids(encoded, vocabulary), payload)
+        return encoded, vocabulary
+
+    def test_flat_match_response(self):
+        encoded, vocabulary = self.round_trip({
+            'success': True,
+            'match_score': 66.67,
+            'matching_skills': ['python', 'react'],
+            'missing_skills': ['docker']
+        })
+        self.assertEqual(vocabulary, ['python', 'react', 'docker'])
+        self.assertEqual(encoded['matching_skills'], [0, 1])
+
+    def test_nested_analyze_response(self):
+        encoded, vocabulary = self.round_trip({
+            'success': True,
+            'skills': {
+                'all': ['python', 'leadership', 'react'],
+                'technical': ['python', 'react'],
+                'soft': ['leadership']
+            },
+            'statistics': {'total_skills': 3, 'word_count': 120}
+        })
+        self.assertEqual(encoded['skills']['technical'], [0, 2])
+        self.assertEqual(len(vocabulary), 3)
+
+    def test_list_of_jobs_shares_vocabulary(self):
+        payload = {
+            'success': True,
+            'matches': [
+                {'job_id': 'a', 'matched_skills': ['python', 'aws'], 'missing_skills': ['go']},
+                {'job_id': 'b', 'matched_skills': ['go'], 'missing_skills': ['python', 'rust']},
+                {'job_id': 'c', 'matched_skills': [], 'missing_skills': []}
+            ]
+        }
+        encoded, vocabulary = self.round_trip(payload)
+        self.assertEqual(vocabulary, ['python', 'aws', 'go', 'rust'])
+        self.assertEqual(encoded['matches'][1]['missing_skills'], [0, 3])
+
+    def test_empty_and_mixed_lists_are_unchanged(self):
+        payload = {
+            'skills': [],
+            'matching_skills': ['python', None],
+            'missing_skills': ['go', {'name': 'rust'}],
+            'matches': [{'matched_skills': ['java']}, 'note', None],
+            'tags': ['python', 'react']
+        }
+        encoded, vocabulary = self.round_trip(payload)
+        self.assertEqual(encoded['matching_skills'], ['python', None])
+        self.assertEqual(encoded['missing_skills'], ['go', {'name': 'rust'}])
+        self.assertEqual(encoded['tags'], ['python', 'react'])
+        self.assertEqual(encoded['matches'][0]['matched_skills'], [vocabulary.index('java')])
+
+    def test_input_is_not_modified(self):
+        payload = {'matches': [{'matched_skills': ['python']}]}
+        encode_skill_ids(payload)
+        self.assertEqual(payload, {'matches': [{'matched_skills': ['python']}]})
+
+
+@unittest.skipIf(orjson is None, 'orjson not installed')
+class OrjsonProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = OrjsonProvider(Flask(__name__))
+
+    def test_matches_stdlib_for_regular_payloads(self):
+        payload = {'b': [1, 2.5, 'x'], 'a': {'nested': True, 'none': None}}
+        self.assertEqual(json.loads(self.provider.dumps(payload)), payload)
+
+    def test_falls_back_to_stdlib_for_big_integers(self):
+        self.assertEqual(json.loads(self.provider.dumps({'requests': 10 ** 20})), {'requests': 10 ** 20})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,11 +6,20 @@ Tests all endpoints with sample data
 
 import requests
 import json
+import os
 import time
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # Service URL
 BASE_URL = "http://localhost:5001"
 
+# Admin token for the profiling endpoints (same value as the service's ADMIN_TOKEN)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
 def test_health():
     """Test health endpoint"""
     print("🔍 Testing health endpoint...")
@@ -102,6 +111,141 @@ def test_match_skills(user_skills):
         print(f"❌ Skill matching error: {e}")
         return False
 
+def test_dictionary_encoding():
+    """Test dictionary-encoded skill responses"""
+    print("\n🔍 Testing dictionary skill encoding...")
+    
+    try:
+        response = requests.post(f"{BASE_URL}/match-skills", json={
+            "user_skills": ["python", "react"],
+            "job_requirements": ["python", "react", "docker"]
+        }, headers={"X-Skill-Encoding": "dictionary"})
+        
+        if response.status_code == 200:
+            data = response.json()
+            vocabulary = data['skill_vocabulary']
+            matching = [vocabulary[i] for i in data['matching_skills']]
+            missing = [vocabulary[i] for i in data['missing_skills']]
+            if matching == ["python", "react"] and missing == ["docker"]:
+                print(f"✅ Dictionary encoding successful")
+                print(f"   Vocabulary: {', '.join(vocabulary)}")
+                return True
+            print(f"❌ Dictionary encoding decoded incorrectly: {matching} / {missing}")
+            return False
+        else:
+            print(f"❌ Dictionary encoding failed: {response.status_code}")
+            print(f"   Error: {response.text}")
+            return False
+    except Exception as e:
+        print(f"❌ Dictionary encoding error: {e}")
+        return False
+
+def test_msgpack_encoding():
+    """Test MessagePack responses and JSON fallback for Accept: */*"""
+    print("\n🔍 Testing MessagePack encoding...")
+    
+    payload = {
+        "user_skills": ["python", "react"],
+        "job_requirements": ["python", "react", "docker"]
+    }
+    
+    try:
+        response = requests.post(f"{BASE_URL}/match-skills", json=payload, headers={"Accept": "*/*"})
+        if response.status_code != 200 or not response.headers.get('content-type', '').startswith('application/json'):
+            print(f"❌ Accept: */* did not return JSON: {response.status_code} {response.headers.get('content-type')}")
+            return False
+        json_data = response.json()
+        
+        if msgpack is None:
+            print("⚠️  msgpack not installed, skipping MessagePack round-trip")
+            return True
+        
+        response = requests.post(f"{BASE_URL}/match-skills", json=payload, headers={"Accept": "application/msgpack"})
+        content_type = response.headers.get('content-type', '')
+        if response.status_code != 200 or not content_type.startswith('application/msgpack'):
+            print(f"❌ MessagePack request failed: {response.status_code} {content_type}")
+            return False
+        
+        data = msgpack.unpackb(response.content)
+        if data == json_data:
+            print(f"✅ MessagePack encoding successful")
+            print(f"   JSON: {len(json.dumps(json_data))} bytes, MessagePack: {len(response.content)} bytes")
+            return True
+        print(f"❌ MessagePack body differs from JSON: {data}")
+        return False
+    except Exception as e:
+        print(f"❌ MessagePack encoding error: {e}")
+        return False
+
+def test_admin_auth():
+    """Test that admin endpoints reject missing and invalid tokens"""
+    print("\n🔍 Testing admin authentication...")
+    
+    try:
+        for headers in ({}, {"X-Admin-Token": "wrong-token"}, {"X-Admin-Token": "pässwörd"}):
+            response = requests.get(f"{BASE_URL}/admin/slow-requests", headers=headers)
+            if response.status_code not in (401, 403):
+                print(f"❌ Admin endpoint accepted {headers or 'no token'}: {response.status_code}")
+                return False
+        print(f"✅ Admin endpoints reject invalid tokens")
+        return True
+    except Exception as e:
+        print(f"❌ Admin authentication error: {e}")
+        return False
+
+def test_admin_profiler():
+    """Test profiler start/dump and the slow-request log"""
+    print("\n🔍 Testing admin profiler...")
+    
+    if not ADMIN_TOKEN:
+        print("⚠️  ADMIN_TOKEN not set, skipping profiler test")
+        return True
+    
+    headers = {"X-Admin-Token": ADMIN_TOKEN}
+    
+    try:
+        response = requests.post(f"{BASE_URL}/admin/profiler/start", json={"seconds": "nan"}, headers=headers)
+        if response.status_code != 400:
+            print(f"❌ Invalid profiler options accepted: {response.status_code}")
+            return False
+        
+        response = requests.post(f"{BASE_URL}/admin/profiler/start", json={"seconds": 10}, headers=headers)
+        if response.status_code != 200:
+            print(f"❌ Profiler start failed: {response.status_code}")
+            print(f"   Error: {response.text}")
+            return False
+        
+        for _ in range(5):
+            requests.post(f"{BASE_URL}/analyze-resume", json={"text": "Python and React developer " * 500})
+        
+        requests.post(f"{BASE_URL}/admin/profiler/stop", headers=headers)
+        time.sleep(1.5)
+        
+        response = requests.get(f"{BASE_URL}/admin/profiler", headers=headers)
+        if response.status_code != 200 or not response.headers.get('content-type', '').startswith('text/plain'):
+            print(f"❌ Profiler dump failed: {response.status_code}")
+            return False
+        
+        lines = response.text.splitlines()
+        samples = response.headers.get('X-Profiler-Samples', 'n/a')
+        if not all(line.rsplit(' ', 1)[-1].isdigit() for line in lines):
+            print(f"❌ Profiler dump is not in collapsed-stack format")
+            return False
+        
+        response = requests.get(f"{BASE_URL}/admin/slow-requests", params={"limit": 5}, headers=headers)
+        if response.status_code != 200:
+            print(f"❌ Slow request log failed: {response.status_code}")
+            return False
+        data = response.json()
+        
+        print(f"✅ Admin profiler successful")
+        print(f"   Stacks: {len(lines)}, samples: {samples}")
+        print(f"   Slow requests (>{data['threshold_ms']}ms): {data['count']}")
+        return True
+    except Exception as e:
+        print(f"❌ Admin profiler error: {e}")
+        return False
+
 def test_analyze_resume():
     """Test complete resume analysis"""
     print("\n🔍 Testing resume analysis...")
@@ -157,7 +301,7 @@ def main():
     
     # Test all endpoints
     tests_passed = 0
-    total_tests = 4
+    total_tests = 8
     
     # Test health
     if test_health():
@@ -172,10 +316,25 @@ def main():
     if user_skills and test_match_skills(user_skills):
         tests_passed += 1
     
+    # Test dictionary skill encoding
+    if test_dictionary_encoding():
+        tests_passed += 1
+    
+    # Test MessagePack encoding
+    if test_msgpack_encoding():
+        tests_passed += 1
+    
     # Test resume analysis
     if test_analyze_resume():
         tests_passed += 1
     
+    # Test admin endpoints
+    if test_admin_auth():
+        tests_passed += 1
+    
+    if test_admin_profiler():
+        tests_passed += 1
+    
     print("\n" + "=" * 50)
     print(f"📊 Test Results: {tests_passed}/{total_tests} tests passed")
     